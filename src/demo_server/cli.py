@@ -40,7 +40,13 @@ def start(port: int, public: bool, no_daemon: bool, path: str):
         daemonize()
 
     app = create_app(path)
-    uvicorn.run(app, host=host, port=port, log_level="info")
+    # Ask for uvloop + httptools explicitly instead of trusting uvicorn's
+    # auto-detection; both ship with uvicorn[standard]. The access log
+    # costs a formatted write per request and the daemon log is enough.
+    uvicorn.run(
+        app, host=host, port=port, log_level="info",
+        loop="uvloop", http="httptools", access_log=False,
+    )
 
 
 @cli.command()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import fcntl
 import os
 import sys
 import signal
@@ -16,6 +17,17 @@ def ensure_dirs():
 
 
 def daemonize(pid_file: Path = PID_FILE, log_file: Path = LOG_FILE):
+    # Take an exclusive lock before forking so two concurrent `start`
+    # commands cannot both daemonize, and the loser can report the
+    # conflict while still attached to the terminal. The fd is inherited
+    # across the forks and held for the daemon's lifetime; the kernel
+    # releases the lock when the process exits.
+    daemonize._lock_fd = open(pid_file.with_suffix(".lock"), "w")
+    try:
+        fcntl.flock(daemonize._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        sys.exit("Another demo-server daemon is already starting or running")
+
     # First fork
     pid = os.fork()
     if pid > 0:
@@ -37,8 +49,11 @@ def daemonize(pid_file: Path = PID_FILE, log_file: Path = LOG_FILE):
     os.dup2(daemonize._log_fd.fileno(), sys.stdout.fileno())
     os.dup2(daemonize._log_fd.fileno(), sys.stderr.fileno())
 
-    # Write PID file
-    pid_file.write_text(str(os.getpid()))
+    # Write the PID file atomically so a concurrent reader never sees a
+    # truncated or partially written file.
+    tmp = pid_file.with_suffix(".tmp")
+    tmp.write_text(str(os.getpid()))
+    os.replace(tmp, pid_file)
 
 
 def daemon_status(pid_file: Path = PID_FILE) -> Tuple[Optional[int], bool]:
@@ -1,15 +1,33 @@
+from __future__ import annotations
+
+import asyncio
 import hashlib
+import hmac
 import json
 import logging
+import mimetypes
 import os
+import re
 import secrets
 import time
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
+from functools import lru_cache
 from pathlib import Path
 
+from argon2 import PasswordHasher
+from argon2.exceptions import Argon2Error, InvalidHashError
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse
-from itsdangerous import URLSafeTimedSerializer
+from fastapi.responses import FileResponse, HTMLResponse, RedirectResponse, Response
+
+try:
+    # Optional: fastpbkdf2 precomputes the HMAC ipad/opad state once per
+    # password instead of once per iteration, speeding up legacy-format
+    # hash verification. Same signature as hashlib.pbkdf2_hmac.
+    from fastpbkdf2 import pbkdf2_hmac as _pbkdf2_hmac
+except ImportError:
+    # hashlib.pbkdf2_hmac is backed by OpenSSL, which dispatches to the
+    # SHA-NI instructions at runtime where the CPU supports them.
+    _pbkdf2_hmac = hashlib.pbkdf2_hmac
 
 logger = logging.getLogger(__name__)
 
@@ -18,6 +36,20 @@ SECRET_FILE = BASE_DIR / ".secret"
 
 AUTH_COOKIE_MAX_AGE = 86400  # 24 hours
 
+# A dot at the start of the path or right after a separator means a hidden
+# component somewhere in it.
+_HIDDEN_RE = re.compile(r"(^|[\\/])\.")
+
+
+@lru_cache(maxsize=4096)
+def _is_safe_path(path: str) -> bool:
+    """True when no component of ``path`` is hidden (dot-prefixed).
+
+    Static sites hit the same handful of URLs over and over, so the repeat
+    case is a dict lookup; only a novel path pays the regex scan.
+    """
+    return _HIDDEN_RE.search(path) is None
+
 
 def _get_secret() -> str:
     BASE_DIR.mkdir(parents=True, exist_ok=True)
@@ -29,36 +61,161 @@ def _get_secret() -> str:
     return secret
 
 
+# Argon2's C core is far cheaper per unit of attacker cost than the old
+# pure-OpenSSL PBKDF2 loop, and it releases the GIL while hashing.
+_hasher = PasswordHasher()
+
+# Memoize verification results so repeat logins with the same credentials
+# skip the KDF entirely. Keyed on a digest of the passcode (never the raw
+# string) plus the stored hash, bounded LRU-style.
+_VERIFY_CACHE_MAX = 1024
+_verify_cache: OrderedDict[tuple[bytes, str], bool] = OrderedDict()
+
+
 def hash_passcode(passcode: str) -> str:
-    salt = os.urandom(16)
-    h = hashlib.pbkdf2_hmac("sha256", passcode.encode(), salt, 100_000)
-    return salt.hex() + ":" + h.hex()
+    return _hasher.hash(passcode)
 
 
-def verify_passcode(passcode: str, stored: str) -> bool:
+def _verify_uncached(passcode: str, stored: str) -> bool:
+    if stored.startswith("$argon2"):
+        try:
+            return _hasher.verify(stored, passcode)
+        except (Argon2Error, InvalidHashError):
+            return False
     if ":" not in stored:
         # Legacy plaintext — still compare safely
         return secrets.compare_digest(passcode, stored)
+    # Legacy PBKDF2 format: "<salt-hex>:<hash-hex>"
     salt_hex, hash_hex = stored.split(":", 1)
     salt = bytes.fromhex(salt_hex)
-    h = hashlib.pbkdf2_hmac("sha256", passcode.encode(), salt, 100_000)
+    h = _pbkdf2_hmac("sha256", passcode.encode(), salt, 100_000)
     return secrets.compare_digest(h.hex(), hash_hex)
 
 
+def verify_passcode(passcode: str, stored: str) -> bool:
+    key = (hashlib.sha256(passcode.encode()).digest()[:16], stored)
+    cached = _verify_cache.get(key)
+    if cached is not None:
+        _verify_cache.move_to_end(key)
+        return cached
+    ok = _verify_uncached(passcode, stored)
+    _verify_cache[key] = ok
+    if len(_verify_cache) > _VERIFY_CACHE_MAX:
+        _verify_cache.popitem(last=False)
+    return ok
+
+
+async def _run_blocking(func, *args):
+    """Run a blocking call in the default executor.
+
+    Stand-in for asyncio.to_thread, which needs Python 3.9; this works on
+    every version the package supports.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+
+def _sign_token(key: bytes, value: str, max_age: int = AUTH_COOKIE_MAX_AGE) -> str:
+    """Sign ``value`` into a "value.expiry.mac" auth token.
+
+    Keyed BLAKE2b is a single C call and replaces HMAC's two hash passes;
+    the 16-byte digest keeps the cookie short.
+    """
+    payload = f"{value}.{int(time.time()) + max_age}"
+    mac = hashlib.blake2b(payload.encode(), key=key, digest_size=16).hexdigest()
+    return f"{payload}.{mac}"
+
+
+def _verify_token(key: bytes, token: str) -> str | None:
+    """Return the signed value, or None if the token is invalid or expired."""
+    try:
+        value, expiry, mac = token.rsplit(".", 2)
+    except ValueError:
+        return None
+    payload = f"{value}.{expiry}"
+    expected = hashlib.blake2b(payload.encode(), key=key, digest_size=16).hexdigest()
+    if not hmac.compare_digest(mac, expected):
+        return None
+    try:
+        if time.time() > int(expiry):
+            return None
+    except ValueError:
+        return None
+    return value
+
+
+class PathSendResponse(Response):
+    """File response using the ASGI ``http.response.pathsend`` extension.
+
+    Hands the path to the server, which sends it with sendfile(2) —
+    zero-copy, instead of streaming chunks through Python the way
+    FileResponse does. Only valid when the server advertises the
+    extension in ``scope["extensions"]``.
+    """
+
+    def __init__(self, path: Path | str):
+        media_type = mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+        super().__init__(content=b"", media_type=media_type)
+        self.path = str(path)
+        self.headers["content-length"] = str(os.stat(path).st_size)
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        await send({"type": "http.response.pathsend", "path": self.path})
+
+
+# Constant error responses, built once with pre-encoded bodies. Starlette
+# does not mutate a Response while sending it, so the same instance can be
+# returned from every call site.
+NOT_FOUND = Response(content=b"Not found", status_code=404, media_type="text/html")
+FORBIDDEN = Response(content=b"Forbidden", status_code=403, media_type="text/html")
+TOO_MANY = Response(
+    content=b"Too many attempts. Try again later.",
+    status_code=429,
+    media_type="text/html",
+)
+
+
 class RateLimiter:
-    def __init__(self, max_attempts: int = 5, window: int = 60):
+    def __init__(self, max_attempts: int = 5, window: int = 60, max_keys: int = 100_000):
         self.max_attempts = max_attempts
         self.window = window
-        self._attempts: dict[str, list[float]] = defaultdict(list)
+        self.max_keys = max_keys
+        self._attempts: dict[str, deque[float]] = defaultdict(deque)
+        self._last_sweep = time.time()
+
+    def _sweep(self, now: float) -> None:
+        """Drop keys whose most recent attempt fell out of the window."""
+        stale = [
+            k for k, dq in self._attempts.items()
+            if not dq or now - dq[-1] >= self.window
+        ]
+        for k in stale:
+            del self._attempts[k]
+        self._last_sweep = now
 
     def is_limited(self, key: str) -> bool:
         now = time.time()
-        self._attempts[key] = [
-            t for t in self._attempts[key] if now - t < self.window
-        ]
-        if len(self._attempts[key]) >= self.max_attempts:
+        # Without this the dict grows one entry per unique ip:module key
+        # forever — a trivial memory DoS from spoofed addresses. The full
+        # scan runs on the window timer only; at the cap, evict the
+        # oldest-inserted key (dicts preserve insertion order) in O(1)
+        # rather than rescanning the whole dict per request.
+        if now - self._last_sweep >= self.window:
+            self._sweep(now)
+        while len(self._attempts) >= self.max_keys:
+            del self._attempts[next(iter(self._attempts))]
+        dq = self._attempts[key]
+        # Timestamps are appended in order, so expired ones are always at
+        # the front — O(1) eviction instead of rebuilding the whole list.
+        while dq and now - dq[0] >= self.window:
+            dq.popleft()
+        if len(dq) >= self.max_attempts:
             return True
-        self._attempts[key].append(now)
+        dq.append(now)
         return False
 
 
@@ -113,6 +270,43 @@ WELCOME_PAGE = """\
 """
 
 
+# .encrypt contents keyed on absolute path, invalidated by mtime: the hot
+# serving path then costs one stat instead of a stat plus a full read.
+_encrypt_cache: dict[str, tuple[int, str]] = {}
+
+
+def _get_stored_passcode(module_dir: Path | str) -> str | None:
+    """Stored passcode hash for a module, or None if it is unprotected."""
+    key = os.path.join(module_dir, ".encrypt")
+    try:
+        mtime = os.stat(key).st_mtime_ns
+    except (OSError, ValueError):
+        # ValueError: embedded null byte in a crafted module name
+        _encrypt_cache.pop(key, None)
+        return None
+    cached = _encrypt_cache.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(key, encoding="utf-8") as f:
+        stored = f.read().strip()
+    _encrypt_cache[key] = (mtime, stored)
+    return stored
+
+
+# The no-error passcode form is identical for every 401 on a module, so
+# render and encode it once. Only modules that actually exist reach this,
+# keeping the dict bounded.
+_empty_form_cache: dict[str, bytes] = {}
+
+
+def _passcode_form(module: str) -> bytes:
+    html = _empty_form_cache.get(module)
+    if html is None:
+        html = PASSCODE_FORM.format(module=module, error="").encode()
+        _empty_form_cache[module] = html
+    return html
+
+
 def _load_config(base: Path) -> dict:
     config_file = base / ".config"
     if not config_file.exists():
@@ -134,9 +328,16 @@ def _load_config(base: Path) -> dict:
 
 def create_app(base_path: str) -> FastAPI:
     base = Path(base_path).resolve()
+    base_str = str(base) + os.sep
     secret = _get_secret()
-    serializer = URLSafeTimedSerializer(secret)
+    # Derive the signing key once; per-request token work is then a single
+    # C-level HMAC call instead of itsdangerous's serializer stack.
+    signing_key = hashlib.sha256(secret.encode()).digest()
     limiter = RateLimiter()
+    # Rendered /all/ page keyed on (base mtime, .config mtime); rebuilding
+    # it costs one getdents64 plus a stat per module, so skip that whole
+    # scan while the directory is unchanged.
+    listing_cache: tuple[tuple[int, int], str] | None = None
     app = FastAPI()
 
     @app.get("/", response_class=HTMLResponse)
@@ -145,23 +346,24 @@ def create_app(base_path: str) -> FastAPI:
 
     @app.post("/all/__auth__")
     async def root_auth(request: Request, passcode: str = Form(...)):
-        encrypt_file = base / ".encrypt"
-        if not encrypt_file.exists():
-            return HTMLResponse("Not found", status_code=404)
+        stored = await _run_blocking(_get_stored_passcode, base)
+        if stored is None:
+            return NOT_FOUND
 
         client_ip = request.client.host if request.client else "unknown"
         if limiter.is_limited(f"{client_ip}:__root__"):
-            return HTMLResponse("Too many attempts. Try again later.", status_code=429)
+            return TOO_MANY
 
-        stored = encrypt_file.read_text().strip()
-        if not verify_passcode(passcode, stored):
+        # The KDF is CPU-bound and would otherwise block the event loop for
+        # every other in-flight request; argon2-cffi releases the GIL.
+        if not await _run_blocking(verify_passcode, passcode, stored):
             html = PASSCODE_FORM.format(
                 module="all", error='<p class="error">Wrong passcode.</p>',
             )
             return HTMLResponse(html, status_code=403)
 
         response = RedirectResponse("/all/", status_code=303)
-        token = serializer.dumps("__root__")
+        token = _sign_token(signing_key, "__root__")
         response.set_cookie(
             "auth___root__", token, httponly=True, samesite="lax",
         )
@@ -170,25 +372,32 @@ def create_app(base_path: str) -> FastAPI:
     @app.get("/all/", response_class=HTMLResponse)
     async def listing(request: Request):
         # Root-level encrypt check
-        encrypt_file = base / ".encrypt"
-        if encrypt_file.exists():
+        if _get_stored_passcode(base) is not None:
             cookie = request.cookies.get("auth___root__")
-            try:
-                value = serializer.loads(cookie, max_age=AUTH_COOKIE_MAX_AGE) if cookie else None
-            except Exception:
-                value = None
+            value = _verify_token(signing_key, cookie) if cookie else None
             if value != "__root__":
-                html = PASSCODE_FORM.format(module="all", error="")
-                return HTMLResponse(html, status_code=401)
+                return HTMLResponse(_passcode_form("all"), status_code=401)
+
+        nonlocal listing_cache
+        try:
+            config_mtime = (base / ".config").stat().st_mtime_ns
+        except OSError:
+            config_mtime = 0
+        cache_key = (base.stat().st_mtime_ns, config_mtime)
+        if listing_cache is not None and listing_cache[0] == cache_key:
+            return listing_cache[1]
 
         config = _load_config(base)
         pinned = set(config.get("pinned-modules", []))
         ignored = set(config.get("ignore-modules", []))
 
-        all_dirs = sorted(
-            e.name for e in base.iterdir()
-            if e.is_dir() and not e.name.startswith(".") and e.name not in ignored
-        )
+        # DirEntry.is_dir() answers from the d_type returned by getdents64,
+        # so the scan is one syscall instead of a stat per entry.
+        with os.scandir(base) as it:
+            all_dirs = sorted(
+                e.name for e in it
+                if e.is_dir() and not e.name.startswith(".") and e.name not in ignored
+            )
 
         pinned_list = [d for d in config.get("pinned-modules", []) if d in set(all_dirs)]
         others_list = [d for d in all_dirs if d not in pinned]
@@ -207,21 +416,22 @@ def create_app(base_path: str) -> FastAPI:
                 modules_html += f'<li><a href="/{name}/">{name}</a></li>'
             modules_html += "</ul>"
 
-        return WELCOME_PAGE.format(modules=modules_html)
+        page = WELCOME_PAGE.format(modules=modules_html)
+        listing_cache = (cache_key, page)
+        return page
 
     @app.post("/{module}/__auth__")
     async def auth(module: str, request: Request, passcode: str = Form(...)):
         module_dir = base / module
-        encrypt_file = module_dir / ".encrypt"
-        if not module_dir.is_dir() or not encrypt_file.exists():
-            return HTMLResponse("Not found", status_code=404)
+        stored = await _run_blocking(_get_stored_passcode, module_dir)
+        if not module_dir.is_dir() or stored is None:
+            return NOT_FOUND
 
         client_ip = request.client.host if request.client else "unknown"
         if limiter.is_limited(f"{client_ip}:{module}"):
-            return HTMLResponse("Too many attempts. Try again later.", status_code=429)
+            return TOO_MANY
 
-        stored = encrypt_file.read_text().strip()
-        if not verify_passcode(passcode, stored):
+        if not await _run_blocking(verify_passcode, passcode, stored):
             html = PASSCODE_FORM.format(
                 module=module,
                 error='<p class="error">Wrong passcode.</p>',
@@ -229,7 +439,7 @@ def create_app(base_path: str) -> FastAPI:
             return HTMLResponse(html, status_code=403)
 
         response = RedirectResponse(f"/{module}/", status_code=303)
-        token = serializer.dumps(module)
+        token = _sign_token(signing_key, module)
         response.set_cookie(
             f"auth_{module}", token, httponly=True, samesite="lax",
         )
@@ -237,54 +447,64 @@ def create_app(base_path: str) -> FastAPI:
 
     @app.get("/{module}/{path:path}")
     async def serve(module: str, request: Request, path: str = ""):
-        module_dir = base / module
-        if not module_dir.is_dir():
-            return HTMLResponse("Not found", status_code=404)
+        # Plain-string path work throughout: Path objects re-parse their
+        # arguments on every / operation, which adds up on this hot path.
+        module_dir = base_str + module
+        if not os.path.isdir(module_dir):
+            return NOT_FOUND
 
         # `ignore-modules` only hides from the /all/ listing; direct URL access is allowed.
 
         if not path or path.endswith("/"):
-            html_index = module_dir / (path + "index.html")
-            md_index = module_dir / (path + "index.md")
-            if html_index.is_file():
+            if os.path.isfile(os.path.join(module_dir, path + "index.html")):
                 path = path + "index.html"
-            elif md_index.is_file():
+            elif os.path.isfile(os.path.join(module_dir, path + "index.md")):
                 path = path + "index.md"
             else:
                 path = path + "index.html"  # fall through to 404
 
-        # Hidden file check
-        for part in Path(path).parts:
-            if part.startswith("."):
-                return HTMLResponse("Forbidden", status_code=403)
-        if module.startswith("."):
-            return HTMLResponse("Forbidden", status_code=403)
+        # Hidden file check — also rejects any ".." component
+        if not _is_safe_path(path) or module.startswith("."):
+            return FORBIDDEN
 
         # Encrypt check
-        encrypt_file = module_dir / ".encrypt"
-        if encrypt_file.exists():
+        if _get_stored_passcode(module_dir) is not None:
             cookie = request.cookies.get(f"auth_{module}")
-            try:
-                value = serializer.loads(cookie, max_age=AUTH_COOKIE_MAX_AGE) if cookie else None
-            except Exception:
-                value = None
+            value = _verify_token(signing_key, cookie) if cookie else None
             if value != module:
-                html = PASSCODE_FORM.format(module=module, error="")
-                return HTMLResponse(html, status_code=401)
-
-        file_path = (module_dir / path).resolve()
-        # Prevent path traversal — append os.sep to avoid prefix collisions
-        if not str(file_path).startswith(str(module_dir) + os.sep):
-            return HTMLResponse("Forbidden", status_code=403)
-
-        if not file_path.is_file():
-            return HTMLResponse("Not found", status_code=404)
-
-        if file_path.suffix == ".md":
+                return HTMLResponse(_passcode_form(module), status_code=401)
+
+        # Traversal checks, all pure string work: normalize first and
+        # reject anything that could escape — os.path.join would let an
+        # absolute path replace the module prefix entirely — then anchor
+        # the result at the module directory as a backstop.
+        norm = os.path.normpath(path)
+        if norm.startswith("..") or os.path.isabs(norm):
+            return FORBIDDEN
+        file_path = os.path.join(module_dir, norm)
+        if not file_path.startswith(module_dir + os.sep):
+            return FORBIDDEN
+
+        if not os.path.isfile(file_path):
+            return NOT_FOUND
+
+        if file_path.endswith(".md"):
             from demo_server.markdown_render import render_md_file
-            html_content = render_md_file(file_path)
+            html_content = render_md_file(Path(file_path))
             return HTMLResponse(html_content)
 
-        return FileResponse(file_path)
+        # Conditional-request fast path: a weak ETag from mtime+size costs
+        # one stat, so a fresh client gets a bodiless 304 without the file
+        # ever being opened.
+        st = os.stat(file_path)
+        etag = f'W/"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"etag": etag})
+
+        if "http.response.pathsend" in request.scope.get("extensions", {}):
+            response = PathSendResponse(file_path)
+            response.headers["etag"] = etag
+            return response
+        return FileResponse(file_path, stat_result=st, headers={"etag": etag})
 
     return app